@@ -1,13 +1,14 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-import yfinance as yf
 from datetime import datetime, timedelta
 
 # Fecha: Sabado, 6 Julio 2024
 # Update:           10.8.2024
 
+# plotly y yfinance se importan dentro de las funciones que los usan, para que
+# la página y la barra lateral se dibujen antes de cargar esos módulos.
+
 # Configuración de tema de Streamlit para imitar los colores de Binance
 st.set_page_config(page_title="Crypto Dashboard", page_icon="📊", layout="centered")
 
@@ -54,54 +55,120 @@ SIMBOLOS_YAHOO = {
     "SOL": "SOL-USD"
 }
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def obtener_datos_historicos(simbolos, fecha_inicio):
     """Obtiene datos históricos de precios para los símbolos dados desde Yahoo Finance."""
+    import yfinance as yf
     try:
         datos = yf.download(simbolos, start=fecha_inicio, end=datetime.now())
+        # yfinance no siempre lanza una excepción si la descarga falla: devuelve un
+        # DataFrame vacío o sin precios. Se detiene antes de retornar para no cachearlo.
+        if datos.empty or datos['Close'].isna().all().all():
+            raise ValueError("Yahoo Finance no devolvió precios")
         return datos['Close']
-    except Exception as e:
+    except Exception:
         st.error("Error al obtener datos históricos. Por favor, verifique su conexión a internet.")
         st.stop()
 
-def main():
-    st.title("Panel de Control de Cartera de Criptomonedas")
+def calcular_valor_cartera(datos_historicos, tenencias):
+    """Calcula el valor diario de cada posición y el total, operando sobre la matriz de precios completa."""
+    precios = datos_historicos[[SIMBOLOS_YAHOO[moneda] for moneda in MONEDAS]].set_axis(MONEDAS, axis=1)
+    montos = pd.Series(tenencias)[MONEDAS]
+    valor_cartera = precios.div(precios.iloc[0]).mul(montos, axis=1)
+    valor_cartera['Total'] = valor_cartera.sum(axis=1)
+    return valor_cartera
 
-    # Añadir párrafo explicativo de uso
-    st.markdown("""
-    **Cómo usar este panel de control:**
-    1. Utilice la barra lateral izquierda para ingresar sus tenencias en USD para cada criptomoneda.
-    2. Seleccione una fecha de inicio para la simulación histórica.
-    3. Explore los gráficos y estadísticas generados automáticamente:
-       - Gráfico circular que muestra la distribución actual de su cartera.
-       - Gráfico de líneas del valor total de su cartera a lo largo del tiempo.
-       - Gráfico de líneas que muestra el rendimiento individual de BTC, ETH, DOGE y SOL.
-       - Tabla de resumen con detalles actuales de su cartera.
-       - Estadísticas clave de rendimiento de la cartera.
-       - Actualice sus tenencias en cualquier momento para ver cómo cambian los resultados.
-    """)
+def calcular_resumen(datos_historicos, tenencias):
+    """Construye la tabla de resumen con operaciones vectoriales sobre los precios inicial y actual."""
+    simbolos = [SIMBOLOS_YAHOO[moneda] for moneda in MONEDAS]
+    precios_actuales = datos_historicos[simbolos].iloc[-1].to_numpy()
+    precios_iniciales = datos_historicos[simbolos].iloc[0].to_numpy()
+    montos = pd.Series(tenencias)[MONEDAS].to_numpy()
+    df_resumen = pd.DataFrame({
+        'Moneda': MONEDAS,
+        'Tenencias (USD)': montos,
+        'Precio Actual': precios_actuales,
+        'Precio Inicial': precios_iniciales,
+        'Cantidad Inicial': montos / precios_iniciales,
+        'Cantidad Actual': montos / precios_actuales,
+        'Valor Actual': montos
+    })
+    df_resumen['Porcentaje'] = df_resumen['Valor Actual'] / df_resumen['Valor Actual'].sum() * 100
+    return df_resumen.sort_values('Valor Actual', ascending=False).reset_index(drop=True)
 
-    # Entrada de usuario para tenencias y fecha de inicio
-    st.sidebar.header("Ingrese sus Tenencias y Fecha de Inicio")
-    tenencias = {}
-    for moneda in MONEDAS:
-        tenencias[moneda] = st.sidebar.number_input(f"Tenencias de {moneda} (USD):", min_value=0.0, value=0.0, step=1.0)
+@st.cache_data
+def calcular_matriz_riesgo(datos_historicos, ventana):
+    """Calcula covarianza y correlación de los retornos diarios de la ventana con productos matriciales.
 
-    fecha_inicio = st.sidebar.date_input("Seleccione fecha de inicio:", value=datetime.now() - timedelta(days=365))
+    Cada par usa las fechas en que ambas monedas tienen precio (como ``DataFrame.cov``),
+    de modo que una moneda listada después de la fecha de inicio no acorta la ventana
+    de las demás. Retorna None si la ventana tiene menos de dos retornos.
+    """
+    precios = datos_historicos[[SIMBOLOS_YAHOO[moneda] for moneda in MONEDAS]].set_axis(MONEDAS, axis=1)
+    retornos = precios.pct_change(fill_method=None).dropna(how='all')
+    if ventana:
+        retornos = retornos.iloc[-ventana:]
+    if len(retornos) < 2:
+        return None
+    x = retornos.to_numpy()
+    presentes = ~np.isnan(x)
+    m = presentes.astype(float)
+    x = np.where(presentes, x, 0.0)
+    n = m.T @ m                # fechas en común por par
+    suma = x.T @ m             # suma[i, j]: suma de retornos de i en fechas donde j tiene dato
+    suma_cuadrados = (x * x).T @ m
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covarianza = (x.T @ x - suma * suma.T / n) / (n - 1)
+        varianza = (suma_cuadrados - suma * suma / n) / (n - 1)
+        correlacion = covarianza / np.sqrt(varianza * varianza.T)
+    covarianza[n < 2] = np.nan
+    correlacion[n < 2] = np.nan
+    return (pd.DataFrame(covarianza, index=MONEDAS, columns=MONEDAS),
+            pd.DataFrame(correlacion, index=MONEDAS, columns=MONEDAS))
 
-    # Obtener datos históricos
-    datos_historicos = obtener_datos_historicos([SIMBOLOS_YAHOO[moneda] for moneda in MONEDAS], fecha_inicio)
+def calcular_contribucion_riesgo(covarianza, valores_actuales):
+    """Porcentaje de la varianza de la cartera que aporta cada moneda según sus pesos actuales.
 
-    # Calcular el valor diario de la cartera
-    valor_cartera = pd.DataFrame(index=datos_historicos.index)
-    for moneda in MONEDAS:
-        valor_cartera[moneda] = tenencias[moneda] / datos_historicos[SIMBOLOS_YAHOO[moneda]].iloc[0] * datos_historicos[SIMBOLOS_YAHOO[moneda]]
-    valor_cartera['Total'] = valor_cartera.sum(axis=1)
+    Retorna None si no se puede calcular (sin covarianza para las monedas en cartera o varianza nula).
+    """
+    valores = valores_actuales[covarianza.columns]
+    valores = valores[valores.notna() & (valores > 0)]
+    covarianza = covarianza.loc[valores.index, valores.index].to_numpy()
+    if valores.empty or np.isnan(covarianza).any():
+        return None
+    pesos = valores.to_numpy() / valores.sum()
+    marginal = covarianza @ pesos
+    varianza_cartera = pesos @ marginal
+    if not varianza_cartera > 0:
+        return None
+    contribucion = pd.Series(pesos * marginal / varianza_cartera * 100, index=valores.index)
+    return contribucion.reindex(valores_actuales.index, fill_value=0.0)
 
-    # Crear gráfico circular de la asignación actual de la cartera
-    asignacion_actual = valor_cartera.iloc[-1][:-1]  # Exclude 'Total'
+@st.cache_data
+def calcular_correlacion_movil(datos_historicos, moneda_a, moneda_b, ventana):
+    """Correlación móvil de los retornos diarios de un par de monedas."""
+    retornos = datos_historicos[[SIMBOLOS_YAHOO[moneda_a], SIMBOLOS_YAHOO[moneda_b]]].pct_change(fill_method=None).dropna()
+    return retornos.iloc[:, 0].rolling(ventana).corr(retornos.iloc[:, 1]).dropna()
 
-    # Filtrar valores 0
-    asignacion_filtrada = asignacion_actual[asignacion_actual > 0.01]  # Adjust threshold as needed
+# Configuración de columnas para st.dataframe (evita el costo de renderizar un Styler de pandas)
+COLUMNAS_RESUMEN = {
+    'Tenencias (USD)': st.column_config.NumberColumn(format="$%.2f"),
+    'Precio Actual': st.column_config.NumberColumn(format="$%.2f"),
+    'Precio Inicial': st.column_config.NumberColumn(format="$%.2f"),
+    'Cantidad Inicial': st.column_config.NumberColumn(format="%.6f"),
+    'Cantidad Actual': st.column_config.NumberColumn(format="%.6f"),
+    'Valor Actual': st.column_config.NumberColumn(format="$%.2f"),
+    'Porcentaje': st.column_config.NumberColumn(format="%.2f%%")
+}
+
+# Las figuras se cachean como objetos go.Figure con cache_resource (sin copiar ni
+# serializar): st.plotly_chart solo llama a to_dict() sobre una figura ya validada,
+# mientras que un dict o JSON se vuelve a construir y validar en cada reejecución.
+# Las figuras cacheadas son compartidas entre sesiones y no deben modificarse.
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_circular(asignacion_filtrada):
+    """Figura del gráfico circular de la asignación actual."""
+    import plotly.express as px
     fig_circular = px.pie(
         values=asignacion_filtrada,
         names=asignacion_filtrada.index,
@@ -125,12 +192,14 @@ def main():
             x=1
         )
     )
-    st.plotly_chart(fig_circular)
+    return fig_circular
 
-    # Crear gráfico de líneas del valor total de la cartera a lo largo del tiempo
-    log_scale = st.checkbox("Mostrar en escala logarítmica")
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_total(valor_total, log_scale):
+    """Figura del gráfico del valor total de la cartera."""
+    import plotly.graph_objects as go
     fig_total = go.Figure()
-    fig_total.add_trace(go.Scatter(x=valor_cartera.index, y=valor_cartera['Total'],
+    fig_total.add_trace(go.Scatter(x=valor_total.index, y=valor_total,
                                    mode='lines', name='Valor Total de la Cartera', line=dict(color=BINANCE_YELLOW)))
     fig_total.update_layout(
         title='Valor Histórico Total de la Cartera',
@@ -143,13 +212,16 @@ def main():
     )
     if log_scale:
         fig_total.update_yaxes(type="log")
-    st.plotly_chart(fig_total)
+    return fig_total
 
-    # Crear gráfico de líneas de los valores individuales de las criptomonedas a lo largo del tiempo
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_individual(valores):
+    """Figura del gráfico de valores individuales por moneda."""
+    import plotly.graph_objects as go
     fig_individual = go.Figure()
     colors = [BINANCE_YELLOW, BINANCE_LIGHT_GRAY, BINANCE_DARK_GRAY, "#6750A4"]
-    for i, moneda in enumerate(["BTC", "ETH", "DOGE", "SOL"]):  # Monedas de ejemplo, incluyendo SOL
-        fig_individual.add_trace(go.Scatter(x=valor_cartera.index, y=valor_cartera[moneda],
+    for i, moneda in enumerate(valores.columns):
+        fig_individual.add_trace(go.Scatter(x=valores.index, y=valores[moneda],
                                             mode='lines', name=moneda, line=dict(color=colors[i])))
     fig_individual.update_layout(
         title='Valores Históricos de Criptomonedas Individuales',
@@ -160,38 +232,149 @@ def main():
         plot_bgcolor=BINANCE_BLACK,
         font_color="white"
     )
-    st.plotly_chart(fig_individual)
+    return fig_individual
 
-    # Mostrar resumen actual de la cartera
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_mapa_calor(matriz, titulo, es_correlacion):
+    """Figura del mapa de calor de correlación o covarianza."""
+    import plotly.graph_objects as go
+    fig_mapa = go.Figure(go.Heatmap(
+        z=matriz.to_numpy(), x=matriz.columns, y=matriz.index,
+        # La correlación se acota a [-1, 1]; la covarianza se centra en 0 para que el rojo indique valores negativos
+        zmin=-1 if es_correlacion else None, zmax=1 if es_correlacion else None,
+        zmid=None if es_correlacion else 0,
+        colorscale=[[0, NEGATIVE_RED], [0.5, BINANCE_DARK_GRAY], [1, POSITIVE_GREEN]],
+        text=matriz.round(4 if es_correlacion else 6).to_numpy(), texttemplate="%{text}"
+    ))
+    fig_mapa.update_layout(
+        title=titulo,
+        height=400,
+        paper_bgcolor=BINANCE_BLACK,
+        plot_bgcolor=BINANCE_BLACK,
+        font_color="white"
+    )
+    return fig_mapa
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_contribucion(contribucion):
+    """Figura del gráfico de barras de contribución al riesgo."""
+    import plotly.graph_objects as go
+    fig_contribucion = go.Figure(go.Bar(
+        x=contribucion.index, y=contribucion,
+        marker_color=[BINANCE_YELLOW if valor >= 0 else NEGATIVE_RED for valor in contribucion]
+    ))
+    fig_contribucion.update_layout(
+        title='Contribución al Riesgo de la Cartera',
+        xaxis_title='Moneda',
+        yaxis_title='Contribución a la Varianza (%)',
+        height=400,
+        paper_bgcolor=BINANCE_BLACK,
+        plot_bgcolor=BINANCE_BLACK,
+        font_color="white"
+    )
+    return fig_contribucion
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def figura_correlacion_movil(correlacion_movil, titulo):
+    """Figura del gráfico de correlación móvil de un par."""
+    import plotly.graph_objects as go
+    fig_movil = go.Figure()
+    fig_movil.add_trace(go.Scatter(x=correlacion_movil.index, y=correlacion_movil,
+                                   mode='lines', name=titulo, line=dict(color=BINANCE_YELLOW)))
+    fig_movil.update_layout(
+        title=titulo,
+        xaxis_title='Fecha',
+        yaxis_title='Correlación',
+        yaxis_range=[-1, 1],
+        height=400,
+        paper_bgcolor=BINANCE_BLACK,
+        plot_bgcolor=BINANCE_BLACK,
+        font_color="white"
+    )
+    return fig_movil
+
+# Ventanas disponibles para la matriz de riesgo (días de retornos; None = todo el periodo)
+VENTANAS_RIESGO = {"30 días": 30, "90 días": 90, "180 días": 180, "365 días": 365, "Todo el periodo": None}
+
+def main():
+    st.title("Panel de Control de Cartera de Criptomonedas")
+
+    # Añadir párrafo explicativo de uso
+    st.markdown("""
+    **Cómo usar este panel de control:**
+    1. Utilice la barra lateral izquierda para ingresar sus tenencias en USD para cada criptomoneda.
+    2. Seleccione una fecha de inicio para la simulación histórica.
+    3. Explore los gráficos y estadísticas generados automáticamente:
+       - Gráfico circular que muestra la distribución actual de su cartera.
+       - Gráfico de líneas del valor total de su cartera a lo largo del tiempo.
+       - Gráfico de líneas que muestra el rendimiento individual de BTC, ETH, DOGE y SOL.
+       - Tabla de resumen con detalles actuales de su cartera.
+       - Mapa de calor de correlación/covarianza, contribución al riesgo y correlación móvil entre pares.
+       - Estadísticas clave de rendimiento de la cartera.
+       - Actualice sus tenencias en cualquier momento para ver cómo cambian los resultados.
+    """)
+
+    # Entrada de usuario para tenencias y fecha de inicio
+    st.sidebar.header("Ingrese sus Tenencias y Fecha de Inicio")
+    tenencias = {}
+    for moneda in MONEDAS:
+        tenencias[moneda] = st.sidebar.number_input(f"Tenencias de {moneda} (USD):", min_value=0.0, value=0.0, step=1.0)
+
+    fecha_inicio = st.sidebar.date_input("Seleccione fecha de inicio:", value=datetime.now() - timedelta(days=365))
+
+    # Dibujar la estructura de la página con marcadores de posición antes de cargar los datos
+    marcador_circular = st.empty()
+    log_scale = st.checkbox("Mostrar en escala logarítmica")
+    marcador_total = st.empty()
+    marcador_individual = st.empty()
     st.header("Resumen Actual de la Cartera")
-    precios_actuales = datos_historicos.iloc[-1]
-    precios_iniciales = datos_historicos.iloc[0]
-    df_resumen = pd.DataFrame({
-        'Moneda': MONEDAS,
-        'Tenencias (USD)': [tenencias[moneda] for moneda in MONEDAS],
-        'Precio Actual': [precios_actuales[SIMBOLOS_YAHOO[moneda]] for moneda in MONEDAS],
-        'Precio Inicial': [precios_iniciales[SIMBOLOS_YAHOO[moneda]] for moneda in MONEDAS],
-        'Cantidad Inicial': [tenencias[moneda] / precios_iniciales[SIMBOLOS_YAHOO[moneda]] for moneda in MONEDAS],
-        'Cantidad Actual': [tenencias[moneda] / precios_actuales[SIMBOLOS_YAHOO[moneda]] for moneda in MONEDAS],
-        'Valor Actual': [tenencias[moneda] for moneda in MONEDAS]
-    })
-    df_resumen['Porcentaje'] = df_resumen['Valor Actual'] / df_resumen['Valor Actual'].sum() * 100
-    df_resumen = df_resumen.sort_values('Valor Actual', ascending=False).reset_index(drop=True)
-    st.table(df_resumen.style.format({
-        'Tenencias (USD)': '${:.2f}',
-        'Precio Actual': '${:.2f}',
-        'Precio Inicial': '${:.2f}',
-        'Cantidad Inicial': '{:.6f}',
-        'Cantidad Actual': '{:.6f}',
-        'Valor Actual': '${:.2f}',
-        'Porcentaje': '{:.2f}%'
-    }).set_properties(**{'background-color': BINANCE_DARK_GRAY,
-                         'color': 'white',
-                         'border-color': BINANCE_LIGHT_GRAY}))
+    marcador_resumen = st.empty()
+    st.header("Estadísticas de la Cartera")
+    marcador_estadisticas = st.empty()
+    st.header("Correlación y Riesgo")
+    col_ventana, col_matriz = st.columns(2)
+    ventana = VENTANAS_RIESGO[col_ventana.selectbox("Ventana de retornos:", list(VENTANAS_RIESGO), index=1)]
+    tipo_matriz = col_matriz.radio("Matriz:", ["Correlación", "Covarianza"], horizontal=True)
+    marcador_mapa = st.empty()
+    marcador_contribucion = st.empty()
+    col_a, col_b, col_movil = st.columns(3)
+    moneda_a = col_a.selectbox("Moneda A:", MONEDAS, index=0)
+    moneda_b = col_b.selectbox("Moneda B:", MONEDAS, index=2)
+    ventana_movil = col_movil.number_input("Ventana móvil (días):", min_value=5, value=30, step=5)
+    marcador_movil = st.empty()
+    for marcador in (marcador_circular, marcador_total, marcador_individual,
+                     marcador_mapa, marcador_contribucion, marcador_movil):
+        marcador.container(height=400, border=True).caption("Cargando gráfico...")
+    marcador_resumen.caption("Cargando resumen...")
+    marcador_estadisticas.caption("Cargando estadísticas...")
+
+    # Obtener datos históricos
+    with st.spinner("Descargando datos históricos..."):
+        datos_historicos = obtener_datos_historicos([SIMBOLOS_YAHOO[moneda] for moneda in MONEDAS], fecha_inicio)
+
+    # Calcular el valor diario de la cartera
+    valor_cartera = calcular_valor_cartera(datos_historicos, tenencias)
+
+    # Crear gráfico circular de la asignación actual de la cartera
+    asignacion_actual = valor_cartera.iloc[-1][:-1]  # Exclude 'Total'
+
+    # Filtrar valores 0
+    asignacion_filtrada = asignacion_actual[asignacion_actual > 0.01]  # Adjust threshold as needed
+    with st.spinner("Generando gráficos..."):
+        marcador_circular.plotly_chart(figura_circular(asignacion_filtrada))
+
+        # Crear gráfico de líneas del valor total de la cartera a lo largo del tiempo
+        marcador_total.plotly_chart(figura_total(valor_cartera['Total'], log_scale))
+
+        # Crear gráfico de líneas de los valores individuales de las criptomonedas a lo largo del tiempo
+        marcador_individual.plotly_chart(figura_individual(valor_cartera[["BTC", "ETH", "DOGE", "SOL"]]))  # Monedas de ejemplo, incluyendo SOL
+
+    # Mostrar resumen actual de la cartera
+    df_resumen = calcular_resumen(datos_historicos, tenencias)
+    marcador_resumen.dataframe(df_resumen, column_config=COLUMNAS_RESUMEN, hide_index=True, width="stretch")
 
     # Mostrar estadísticas de la cartera
-    st.header("Estadísticas de la Cartera")
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3 = marcador_estadisticas.container().columns(3)
 
     with col1:
         st.metric("Valor Inicial", f"${valor_cartera['Total'].iloc[0]:.0f}")
@@ -219,5 +402,38 @@ def main():
             delta_color="normal"
         )
 
+    # Mostrar correlación, covarianza y contribución al riesgo
+    with st.spinner("Calculando matriz de riesgo..."):
+        matrices = calcular_matriz_riesgo(datos_historicos, ventana)
+        valores_actuales = valor_cartera.iloc[-1][:-1]  # Exclude 'Total'
+        if matrices is None:
+            marcador_mapa.info("No hay suficientes datos en la ventana seleccionada para calcular la matriz de riesgo. "
+                               "Elija una fecha de inicio anterior.")
+            marcador_contribucion.empty()
+        else:
+            covarianza, correlacion = matrices
+            if tipo_matriz == "Correlación":
+                marcador_mapa.plotly_chart(figura_mapa_calor(correlacion, "Correlación de Retornos Diarios", True))
+            else:
+                marcador_mapa.plotly_chart(figura_mapa_calor(covarianza, "Covarianza de Retornos Diarios", False))
+
+            contribucion = calcular_contribucion_riesgo(covarianza, valores_actuales)
+            if not valores_actuales.sum() > 0:
+                marcador_contribucion.info("Ingrese sus tenencias para ver la contribución de cada moneda al riesgo.")
+            elif contribucion is None:
+                marcador_contribucion.info("No hay suficientes datos para calcular la contribución al riesgo de las monedas en cartera.")
+            else:
+                marcador_contribucion.plotly_chart(figura_contribucion(contribucion))
+
+        if moneda_a == moneda_b:
+            marcador_movil.info("Seleccione dos monedas distintas para ver su correlación móvil.")
+        else:
+            correlacion_movil = calcular_correlacion_movil(datos_historicos, moneda_a, moneda_b, int(ventana_movil))
+            titulo = f"Correlación Móvil {moneda_a}/{moneda_b} ({int(ventana_movil)} días)"
+            if correlacion_movil.empty:
+                marcador_movil.info("No hay suficientes datos en común para la ventana móvil seleccionada.")
+            else:
+                marcador_movil.plotly_chart(figura_correlacion_movil(correlacion_movil, titulo))
+
 if __name__ == "__main__":
     main()